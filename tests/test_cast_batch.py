@@ -0,0 +1,120 @@
+import importlib.util
+import os
+import pathlib
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+# Keep numba's on-disk cache for this module name away from the one the app itself uses
+if "NUMBA_CACHE_DIR" not in os.environ:
+    _numba_cache_dir = tempfile.TemporaryDirectory()
+    os.environ["NUMBA_CACHE_DIR"] = _numba_cache_dir.name
+
+_path = pathlib.Path(__file__).resolve().parent.parent / "voxel-traverse.py"
+_spec = importlib.util.spec_from_file_location("voxel_traverse", _path)
+voxel_traverse = importlib.util.module_from_spec(_spec)
+# numba's on-disk cache looks the module up by name
+sys.modules[_spec.name] = voxel_traverse
+_spec.loader.exec_module(voxel_traverse)
+
+
+def _random_ray(rng: random.Random, width: int, height: int):
+    origin = (rng.uniform(-10, width + 10), rng.uniform(-10, height + 10))
+    kind = rng.random()
+    if kind < 0.1:
+        direction = (0.0, rng.uniform(-3, 3))
+    elif kind < 0.2:
+        direction = (rng.uniform(-3, 3), 0.0)
+    elif kind < 0.3:
+        v = rng.uniform(-3, 3)
+        direction = (v, rng.choice([v, -v]))
+    else:
+        direction = (rng.uniform(-3, 3), rng.uniform(-3, 3))
+    return origin, direction
+
+
+def test_cast_batch_matches_cast():
+    rng = random.Random(0)
+    for _ in range(200):
+        width, height = rng.randint(1, 20), rng.randint(1, 20)
+        raycaster = voxel_traverse.VoxelRaycaster(width, height)
+        rays = [_random_ray(rng, width, height) for _ in range(rng.randint(1, 16))]
+        origins = np.array([origin for origin, _ in rays])
+        directions = np.array([direction for _, direction in rays])
+
+        batch = raycaster.cast_batch(origins, directions)
+
+        assert len(batch) == len(rays)
+        for (origin, direction), cells in zip(rays, batch):
+            assert cells.tolist() == raycaster.cast(origin, direction).tolist()
+
+
+def test_cast_batch_clips_outside_origins():
+    raycaster = voxel_traverse.VoxelRaycaster(15, 10)
+
+    entering, missing = raycaster.cast_batch([[-3.5, 5.5], [15.5, 5.5]], [[1, 0], [1, 0]])
+
+    assert entering.tolist() == [[x, 5] for x in range(15)]
+    assert missing.tolist() == []
+
+
+def test_cast_clips_outside_origins():
+    raycaster = voxel_traverse.VoxelRaycaster(15, 10)
+
+    entering = raycaster.cast((-3.5, 5.5), (1, 0))
+    assert entering.tolist() == [[x, 5] for x in range(15)]
+
+    missing = raycaster.cast((15.5, 5.5), (1, 0))
+    assert missing.tolist() == []
+
+    on_far_edge = raycaster.cast((15.0, 5.5), (-1, 0))
+    assert on_far_edge.tolist() == [[x, 5] for x in range(14, -1, -1)]
+
+    standing_still = raycaster.cast((-1.0, 5.5), (0, 0))
+    assert standing_still.tolist() == []
+
+
+def test_cast_corner_ties_match_across_backends():
+    width, height = 13, 11
+    raycaster = voxel_traverse.VoxelRaycaster(width, height)
+    # The uncompiled kernel is what runs when numba is not installed
+    plain_cast_nb = getattr(voxel_traverse._cast_nb, "py_func", voxel_traverse._cast_nb)
+    out = np.empty((width + height - 1, 2), dtype=np.int32)
+
+    # Passes exactly through grid corners, where ties step in y
+    xs = [1, 2, 3, 3, 4, 5, 5, 6, 7, 8, 8, 9, 10, 11, 11, 12]
+    ys = [1, 1, 1, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4, 5, 5]
+    assert raycaster.cast((1, 1), (5, 2)).tolist() == [list(cell) for cell in zip(xs, ys)]
+
+    # Rays from grid corners, with directions in steps of 1/cell_size like RayView drags
+    rng = random.Random(0)
+    for cell_size in (1, 7, 40):
+        for _ in range(500):
+            origin = (rng.randrange(width), rng.randrange(height))
+            direction = tuple(rng.randint(-2 * cell_size, 2 * cell_size) / cell_size for _ in "xy")
+            n = plain_cast_nb(float(origin[0]), float(origin[1]), *direction, width, height, out)
+            assert raycaster.cast(origin, direction).tolist() == out[:n].tolist()
+
+
+def test_cast_matches_cast_batch_on_diagonal_rays():
+    width, height = 21, 13
+    raycaster = voxel_traverse.VoxelRaycaster(width, height)
+
+    # RayView positions move in steps of 1/cell_size, which puts diagonal rays right next to
+    # grid corners. These two are from dragging with a cell size of 17
+    origins = [(243 / 17, 39 / 17), (31 / 17, 65 / 17)]
+    directions = [(46 / 17, 46 / 17), (-28 / 17, -28 / 17)]
+    rng = random.Random(0)
+    for cell_size in (16, 17, 32, 64):
+        for _ in range(500):
+            x, y = rng.randrange(width * cell_size), rng.randrange(height * cell_size)
+            d = rng.randint(1, 3 * cell_size) / cell_size
+            origins.append((x / cell_size, y / cell_size))
+            directions.append((rng.choice([d, -d]), rng.choice([d, -d])))
+
+    batch = raycaster.cast_batch(origins, directions)
+
+    for origin, direction, cells in zip(origins, directions, batch):
+        assert raycaster.cast(origin, direction).tolist() == cells.tolist()
@@ -6,17 +6,89 @@ http://www.cse.yorku.ca/~amana/research/grid.pdf
 
 
 import math
-from math import copysign, floor
-from typing import Iterator, Tuple
+from typing import List, Optional, Tuple
 
+import numpy as np
 import pygame
 import pygame.freetype
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Writes the cells visited by the ray into `out` and returns how many there are. Compiled with
+# numba when it is installed, and run as plain Python otherwise
+def _cast_nb(ox, oy, dir_x, dir_y, width, height, out):
+    x = int(np.floor(ox))
+    y = int(np.floor(oy))
+
+    # There are no bounds checks on `out`, so never start stepping from outside the grid
+    if not (0 <= x < width and 0 <= y < height):
+        return 0
+
+    # Mirrors math.copysign(1, d), so a zero direction steps forward
+    stepX = -1 if dir_x < 0 else 1
+    stepY = -1 if dir_y < 0 else 1
+    positiveStepX = 1 if stepX > 0 else 0
+    positiveStepY = 1 if stepY > 0 else 0
+    justOutX = positiveStepX * (width - 1) + stepX
+    justOutY = positiveStepY * (height - 1) + stepY
+
+    # Axis-aligned rays never step along the other axis, so they are a plain counter
+    if dir_x == 0:
+        n = 0
+        for cell_y in range(y, justOutY, stepY):
+            out[n, 0] = x
+            out[n, 1] = cell_y
+            n += 1
+        return n
+
+    if dir_y == 0:
+        n = 0
+        for cell_x in range(x, justOutX, stepX):
+            out[n, 0] = cell_x
+            out[n, 1] = y
+            n += 1
+        return n
+
+    # Divide once up front, a zero direction never crosses a grid line on that axis
+    inv_dx = 1.0 / dir_x if dir_x != 0 else np.inf
+    inv_dy = 1.0 / dir_y if dir_y != 0 else np.inf
+    tMaxX = (positiveStepX - (ox - x)) * inv_dx
+    tMaxY = (positiveStepY - (oy - y)) * inv_dy
+    tDeltaX = stepX * inv_dx
+    tDeltaY = stepY * inv_dy
+
+    n = 0
+    while True:
+        out[n, 0] = x
+        out[n, 1] = y
+        n += 1
+
+        if tMaxX < tMaxY:
+            x += stepX
+            if x == justOutX:
+                return n
+            tMaxX += tDeltaX
+        else:
+            y += stepY
+            if y == justOutY:
+                return n
+            tMaxY += tDeltaY
+
+
+if njit is not None:
+    _cast_nb = njit(cache=True)(_cast_nb)
+
 
 class VoxelRaycaster:
     def __init__(self, width: int, height: int) -> None:
         self._width = width
         self._height = height
+        # A ray visits at most width + height - 1 cells once inside the grid
+        self._out = np.empty((width + height - 1, 2), dtype=np.int32)
 
     @property
     def width(self):
@@ -29,54 +101,137 @@ class VoxelRaycaster:
     def set_dim(self, width: int, height: int) -> None:
         self._width = width
         self._height = height
+        self._out = np.empty((width + height - 1, 2), dtype=np.int32)
 
-    def cast(
+    def _enter_grid(
         self, origin: Tuple[float, float], direction: Tuple[float, float]
-    ) -> Iterator[Tuple[int, int]]:
+    ) -> Optional[Tuple[float, float]]:
+        """
+        Return the point where the ray enters the grid, found with a slab test, or None if the
+        ray misses it. Origins inside the grid are returned unchanged.
+        """
+        if 0 <= origin[0] < self.width and 0 <= origin[1] < self.height:
+            return origin
+
+        slabs = (
+            (origin[0], direction[0], self.width),
+            (origin[1], direction[1], self.height),
+        )
+
+        t_enter = 0.0
+        t_exit = math.inf
+        for o, d, size in slabs:
+            if d == 0:
+                if not 0 <= o < size:
+                    return None
+            else:
+                t_near = -o / d
+                t_far = (size - o) / d
+                if t_near > t_far:
+                    t_near, t_far = t_far, t_near
+                t_enter = max(t_enter, t_near)
+                t_exit = min(t_exit, t_far)
+
+        if t_enter >= t_exit:
+            return None
+
+        # Landing exactly on the far edge (or rounding past either edge) would floor to a cell
+        # outside the grid
+        x, y = (min(max(o + t_enter * d, 0.0), math.nextafter(size, 0)) for o, d, size in slabs)
+        return x, y
+
+    def _enter_grid_batch(
+        self, origins: np.ndarray, directions: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized `_enter_grid`. Returns the entry points, along with a mask of the rays that
+        hit the grid at all. Entries of rays that miss are set to 0.
         """
-        Preconditions:
-            - 0 <= x < self.width
-            - 0 <= y < self.height
+        sizes = np.array([self.width, self.height], dtype=np.float64)
+        inside = np.all((origins >= 0) & (origins < sizes), axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_a = -origins / directions
+            t_b = (sizes - origins) / directions
+        # A zero direction never leaves its slab, so it either always or never overlaps it
+        in_slab = (origins >= 0) & (origins < sizes)
+        t_near = np.where(directions != 0, np.minimum(t_a, t_b), np.where(in_slab, -np.inf, np.inf))
+        t_far = np.where(directions != 0, np.maximum(t_a, t_b), np.where(in_slab, np.inf, -np.inf))
+        t_enter = np.maximum(t_near.max(axis=1), 0.0)
+        t_exit = t_far.min(axis=1)
+
+        hit = inside | (t_enter < t_exit)
+        with np.errstate(invalid="ignore"):
+            entries = origins + t_enter[:, None] * directions
+        # Landing exactly on the far edge (or rounding past either edge) would floor to a cell
+        # outside the grid
+        entries = np.minimum(np.maximum(entries, 0.0), np.nextafter(sizes, 0))
+        entries = np.where(inside[:, None], origins, entries)
+        return np.where(hit[:, None], entries, 0.0), hit
+
+    def cast(self, origin: Tuple[float, float], direction: Tuple[float, float]) -> np.ndarray:
         """
-        x = floor(origin[0])
-        y = floor(origin[1])
+        Return the cells visited by the ray as an ``(n, 2)`` array. A ray starting outside of the
+        grid is traced from where it enters it. This is a view into a buffer that is reused across
+        calls.
+        """
+        entry = self._enter_grid(origin, direction)
+        if entry is None:
+            return np.empty((0, 2), dtype=np.int32)
+
+        # Always hand the kernel floats, each int/float mix would compile another signature
+        ox, oy = float(entry[0]), float(entry[1])
+        dir_x, dir_y = float(direction[0]), float(direction[1])
+        n = _cast_nb(ox, oy, dir_x, dir_y, self.width, self.height, self._out)
+        return self._out[:n]
+
+    def cast_batch(self, origins: np.ndarray, directions: np.ndarray) -> List[np.ndarray]:
+        """
+        Cast ``k`` rays given as ``(k, 2)`` arrays of origins and directions, advancing all of
+        them in lockstep. Returns the visited cells of each ray as an ``(n, 2)`` array. Like with
+        `cast`, rays starting outside of the grid are traced from where they enter it.
+        """
+        origins = np.asarray(origins, dtype=np.float64)
+        directions = np.asarray(directions, dtype=np.float64)
+        dir_x, dir_y = directions[:, 0], directions[:, 1]
+
+        origins, alive = self._enter_grid_batch(origins, directions)
+        x = np.floor(origins[:, 0]).astype(np.int32)
+        y = np.floor(origins[:, 1]).astype(np.int32)
 
-        dir_x, dir_y = direction
-        stepX = int(copysign(1, dir_x))
-        stepY = int(copysign(1, dir_y))
+        stepX = np.where(dir_x < 0, -1, 1).astype(np.int32)
+        stepY = np.where(dir_y < 0, -1, 1).astype(np.int32)
         positiveStepX = stepX > 0
         positiveStepY = stepY > 0
-        justOutX = positiveStepX * (self.width - 1) + stepX
-        justOutY = positiveStepY * (self.height - 1) + stepY
 
-        # Unlike c, python does not implicitly set division by 0 to inf
-        if dir_x != 0:
-            tMaxX = (positiveStepX - (origin[0] - x)) / dir_x
-            tDeltaX = stepX / dir_x
-        else:
-            tMaxX = math.inf
-            tDeltaX = math.inf
+        with np.errstate(divide="ignore"):
+            inv_dx = np.where(dir_x != 0, 1.0 / dir_x, np.inf)
+            inv_dy = np.where(dir_y != 0, 1.0 / dir_y, np.inf)
+        tMaxX = (positiveStepX - (origins[:, 0] - x)) * inv_dx
+        tMaxY = (positiveStepY - (origins[:, 1] - y)) * inv_dy
+        tDeltaX = stepX * inv_dx
+        tDeltaY = stepY * inv_dy
 
-        if dir_y != 0:
-            tMaxY = (positiveStepY - (origin[1] - y)) / dir_y
-            tDeltaY = stepY / dir_y
-        else:
-            tMaxY = math.inf
-            tDeltaY = math.inf
+        # A ray starting inside the grid visits at most width + height - 1 cells
+        cells = np.empty((self.width + self.height - 1, len(origins), 2), dtype=np.int32)
+        lengths = np.zeros(len(origins), dtype=np.intp)
 
-        while True:
-            yield x, y
+        for i in range(len(cells)):
+            cells[i, :, 0] = x
+            cells[i, :, 1] = y
+            lengths += alive
 
-            if tMaxX < tMaxY:
-                x += stepX
-                if x == justOutX:
-                    return
-                tMaxX += tDeltaX
-            else:
-                y += stepY
-                if y == justOutY:
-                    return
-                tMaxY += tDeltaY
+            mx = tMaxX < tMaxY
+            x += stepX * mx
+            y += stepY * ~mx
+            tMaxX = np.where(mx, tMaxX + tDeltaX, tMaxX)
+            tMaxY = np.where(mx, tMaxY, tMaxY + tDeltaY)
+
+            alive &= (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+            if not alive.any():
+                break
+
+        return [cells[:n, i] for i, n in enumerate(lengths)]
 
 
 class RayView:
@@ -89,6 +244,7 @@ class RayView:
         self.dx, self.dy = 6, 6
         self.radius = 5
         self.click_radius = 12
+        self.click_radius_sq = self.click_radius * self.click_radius
         self.start_hovered = True
 
     def _grid_to_pos(self, x, y):
@@ -96,11 +252,21 @@ class RayView:
         new_y = y * self.grid.cell_size - self.grid.y
         return new_x, new_y
 
+    def _is_clicking(self, mouse_x: int, mouse_y: int, x: float, y: float) -> bool:
+        # _grid_to_pos inlined, so no tuple is built on every mouse motion
+        grid = self.grid
+        off_x = mouse_x - (x * grid.cell_size - grid.x)
+        off_y = mouse_y - (y * grid.cell_size - grid.y)
+        # Reject with a bounding box first, and compare squared distances to avoid the sqrt
+        if abs(off_x) > self.click_radius or abs(off_y) > self.click_radius:
+            return False
+        return off_x * off_x + off_y * off_y <= self.click_radius_sq
+
     def is_hovering(self, mouse_x: int, mouse_y: int) -> bool:
-        if math.dist((mouse_x, mouse_y), self._grid_to_pos(self.dx, self.dy)) <= self.click_radius:
+        if self._is_clicking(mouse_x, mouse_y, self.dx, self.dy):
             self.start_hovered = False
             return True
-        elif math.dist((mouse_x, mouse_y), self._grid_to_pos(self.x, self.y)) <= self.click_radius:
+        elif self._is_clicking(mouse_x, mouse_y, self.x, self.y):
             self.start_hovered = True
             return True
         return False
@@ -148,12 +314,21 @@ class GridView:
         self.grid_height = self.height // self.cell_size + 1
 
         self.grid = VoxelRaycaster(self.grid_width, self.grid_height)
+        self._update_cell_sprite()
+
+        self._grid_cache = None
+        self._grid_cache_key = None
+
+    def _update_cell_sprite(self) -> None:
+        self._cell_sprite = pygame.Surface((self.cell_size, self.cell_size))
+        self._cell_sprite.fill((0, 0, 0))
 
     def reset_position(self):
         self.x, self.y = 0, 0
 
     def reset_zoom(self):
         self.cell_size = 32
+        self._update_cell_sprite()
 
     def zoom(self, amount: int):
         self.cell_size += amount
@@ -161,6 +336,7 @@ class GridView:
             self.cell_size = 16
         elif self.cell_size > 64:
             self.cell_size = 64
+        self._update_cell_sprite()
 
     def translate(self, x_change: int, y_change: int):
         self.x += x_change
@@ -172,6 +348,36 @@ class GridView:
         self.grid_height = self.height // self.cell_size + 1
         self.grid.set_dim(self.grid_width, self.grid_height)
 
+    def _get_grid_surface(self) -> pygame.surface.Surface:
+        # The lines only depend on the zoom and grid size, panning just moves where it is blitted
+        key = (self.cell_size, self.grid_width, self.grid_height)
+        if key != self._grid_cache_key:
+            line_x = self.cell_size * self.grid_width
+            line_y = self.cell_size * self.grid_height
+            self._grid_cache = pygame.Surface((line_x + 1, line_y + 1))
+            self._grid_cache.fill((255, 255, 255))
+            self._grid_cache.set_colorkey((255, 255, 255), pygame.RLEACCEL)
+
+            # Snake through the lines so each direction takes a single draw.lines call, the
+            # segments joining neighbouring lines run along the border which is drawn anyway
+            vertical = []
+            for i in range(self.grid_width + 1):
+                x = i * self.cell_size
+                ends = [(x, 0), (x, line_y)]
+                vertical += ends if i % 2 == 0 else ends[::-1]
+
+            horizontal = []
+            for i in range(self.grid_height + 1):
+                y = i * self.cell_size
+                ends = [(0, y), (line_x, y)]
+                horizontal += ends if i % 2 == 0 else ends[::-1]
+
+            pygame.draw.lines(self._grid_cache, (0, 0, 0), False, vertical)
+            pygame.draw.lines(self._grid_cache, (0, 0, 0), False, horizontal)
+
+            self._grid_cache_key = key
+        return self._grid_cache
+
     def _set_cursor(self, cursor) -> None:
         if self.last_cursor != cursor:
             pygame.mouse.set_cursor(cursor)
@@ -216,10 +422,11 @@ class GridView:
                     self._set_cursor(pygame.SYSTEM_CURSOR_ARROW)
 
     def get_rel_cell_xy(self, x_pos: int, y_pos: int):
-        offset_x = self.x % self.cell_size
-        offset_y = self.y % self.cell_size
-        cell_x = (x_pos - offset_x) / self.cell_size + int(self.x % self.cell_size != 0)
-        cell_y = (y_pos - offset_y) / self.cell_size + int(self.y % self.cell_size != 0)
+        cell_size = self.cell_size
+        offset_x = self.x % cell_size
+        offset_y = self.y % cell_size
+        cell_x = (x_pos - offset_x) / cell_size + int(offset_x != 0)
+        cell_y = (y_pos - offset_y) / cell_size + int(offset_y != 0)
         return cell_x, cell_y
 
     def on_loop(self) -> None:
@@ -228,15 +435,7 @@ class GridView:
 
     def on_render(self) -> None:
         # First, we draw the grid boundaries
-        for i in range(self.grid_width + 1):
-            line_x = i * self.cell_size - self.x
-            line_y = self.cell_size * self.grid_height - self.y
-            pygame.draw.line(self._display_surf, (0, 0, 0), (line_x, -self.y), (line_x, line_y))
-
-        for i in range(self.grid_height + 1):
-            line_y = i * self.cell_size - self.y
-            line_x = self.cell_size * self.grid_width - self.x
-            pygame.draw.line(self._display_surf, (0, 0, 0), (-self.x, line_y), (line_x, line_y))
+        self._display_surf.blit(self._get_grid_surface(), (-self.x, -self.y))
 
         # Next, we draw the grid cells
         start_x, start_y = self.ray_view.x, self.ray_view.y
@@ -246,17 +445,10 @@ class GridView:
             (end_x - start_x, end_y - start_y),
         )
 
-        for x, y in voxel_raycast:
-            pygame.draw.rect(
-                self._display_surf,
-                (0, 0, 0),
-                pygame.Rect(
-                    x * self.cell_size - self.x,
-                    y * self.cell_size - self.y,
-                    self.cell_size,
-                    self.cell_size,
-                ),
-            )
+        # Work out every cell's screen position in one vectorized step
+        positions = voxel_raycast * self.cell_size - (self.x, self.y)
+        cell_sprite = self._cell_sprite
+        self._display_surf.blits([(cell_sprite, pos) for pos in positions.tolist()], doreturn=False)
 
         # Finally, we draw the ray
         self.ray_view.on_render()
@@ -269,6 +461,7 @@ class InfoViewUI:
         self._font = pygame.freetype.SysFont(self.font, 16)
         self._text = ""
         self._rendered_font = None
+        self._text_rect = None
 
         self.max_text_width = 0
         self.max_text_height = 0
@@ -282,15 +475,15 @@ class InfoViewUI:
         if text != self._text:
             self._text = text
             self._rendered_font, _ = self._font.render(text, (255, 255, 255))
-
-    def on_render(self):
-        if self._rendered_font is not None:
             self.max_text_width = max(self._rendered_font.get_width(), self.max_text_width)
             self.max_text_height = max(self._rendered_font.get_height(), self.max_text_height)
-            text_rect = pygame.Rect(
+            self._text_rect = pygame.Rect(
                 16 - 8, 16 - 8, self.max_text_width + 8 * 2, self.max_text_height + 8 * 2
             )
-            pygame.draw.rect(self._display_surf, (0, 0, 0), text_rect)
+
+    def on_render(self):
+        if self._rendered_font is not None:
+            pygame.draw.rect(self._display_surf, (0, 0, 0), self._text_rect)
             self._display_surf.blit(self._rendered_font, (16, 16))
 
 
@@ -300,13 +493,43 @@ class App:
         self.size = self.weight, self.height = 640, 400
         self._fps_clock = pygame.time.Clock()
 
+        # Last rendered scene, without the info overlay
+        self._frame_cache = None
+        self._frame_key = None
+
     def on_init(self) -> bool:
         pygame.init()
         self._display_surf = pygame.display.set_mode(self.size, pygame.RESIZABLE)
+        # Have SDL drop every event type that no handler looks at
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(
+            [
+                pygame.QUIT,
+                pygame.KEYDOWN,
+                pygame.MOUSEBUTTONDOWN,
+                pygame.MOUSEBUTTONUP,
+                pygame.MOUSEMOTION,
+            ]
+        )
         self.grid_view = GridView(self._display_surf)
         self.info_ui = InfoViewUI(self._display_surf)
         return True
 
+    def _get_events(self) -> list:
+        """
+        Return the queued events, with every run of consecutive MOUSEMOTION events merged into
+        one that has the last position and the summed relative motion.
+        """
+        events = []
+        for event in pygame.event.get():
+            if event.type == pygame.MOUSEMOTION and events and events[-1].type == event.type:
+                last_rel = events[-1].rel
+                rel = (last_rel[0] + event.rel[0], last_rel[1] + event.rel[1])
+                events[-1] = pygame.event.Event(event.type, {**event.dict, "rel": rel})
+            else:
+                events.append(event)
+        return events
+
     def on_event(self, event) -> None:
         if event.type == pygame.QUIT:
             self._running = False
@@ -316,13 +539,37 @@ class App:
     def on_loop(self) -> None:
         self.grid_view.on_loop()
 
+    def _scene_key(self) -> tuple:
+        grid_view = self.grid_view
+        ray_view = grid_view.ray_view
+        return (
+            self._display_surf.get_size(),
+            grid_view.cell_size,
+            grid_view.grid_width,
+            grid_view.grid_height,
+            grid_view.x,
+            grid_view.y,
+            ray_view.x,
+            ray_view.y,
+            ray_view.dx,
+            ray_view.dy,
+        )
+
     def on_render(self) -> None:
-        self._display_surf.fill((255, 255, 255))
-        self.grid_view.on_render()
+        # The scene only depends on the key, so reuse the last frame while nothing moves
+        key = self._scene_key()
+        if key != self._frame_key:
+            self._display_surf.fill((255, 255, 255))
+            self.grid_view.on_render()
+            self._frame_cache = self._display_surf.copy()
+            self._frame_key = key
+        else:
+            self._display_surf.blit(self._frame_cache, (0, 0))
         self.info_ui.on_render()
         pygame.display.flip()
         self._fps_clock.tick(60)
-        self.info_ui.text = "FPS: " + str(self._fps_clock.get_fps())[:4]
+        # Whole numbers keep the text stable between frames, so it is rarely re-rendered
+        self.info_ui.text = f"FPS: {int(self._fps_clock.get_fps())}"
 
     def on_cleanup(self) -> None:
         pygame.quit()
@@ -332,7 +579,7 @@ class App:
             self._running = True
 
         while self._running:
-            for event in pygame.event.get():
+            for event in self._get_events():
                 self.on_event(event)
             self.on_loop()
             self.on_render()